@@ -1,13 +1,20 @@
+import bisect
 import json
 import os
 import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
 import requests
 import yfinance as yf
+from requests.adapters import HTTPAdapter
 
-
+try:
+    import orjson
+except ImportError:  # 없으면 표준 json 사용
+    orjson = None
 
 
 KST = ZoneInfo("Asia/Seoul")
@@ -23,36 +30,76 @@ FORCE_CHAT_ID = os.environ.get("TELEGRAM_FORCE_CHAT_ID")
 FORCE_CHAT_ID = int(FORCE_CHAT_ID) if FORCE_CHAT_ID else None
 
 TG_BASE = f"https://api.telegram.org/bot{BOT_TOKEN}"
+TG_MAX_MESSAGE_LEN = 4096
+
+# 티커 정리/분리용 (모듈 로드 시 1회 컴파일)
+TICKER_CLEAN_RE = re.compile(r"[^A-Za-z0-9\.\-\_]")
+TICKER_SPLIT_RE = re.compile(r"[,\s]+")
+
+# Telegram/Yahoo 호출 간 TCP/TLS 연결 재사용
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+# 일봉은 마지막 두 종가만 필요 (5거래일이면 주말/연휴도 커버)
+DAILY_PERIOD = "5d"
+# 애프터마켓 마지막 가격만 필요 -> 1분봉 대신 5분봉으로 행 수 1/5
+INTRADAY_INTERVAL = "5m"
+
+# build_report 종목별 조회 동시 실행 수
+MAX_FETCH_WORKERS = 8
 
 
 # ---------------------------
 # State I/O
 # ---------------------------
 def load_state() -> dict:
-    with open(STATE_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
+    # 바이트로 한 번에 읽어 바로 파싱 (json은 UTF-8 bytes 직접 지원)
+    with open(STATE_PATH, "rb", buffering=64 * 1024) as f:
+        raw = f.read()
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
 
 
 def save_state(state: dict) -> None:
-    with open(STATE_PATH, "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+    # 임시파일에 한 번에 쓰고 교체 (쓰는 도중 죽어도 state.json이 깨지지 않게)
+    if orjson is not None:
+        data = orjson.dumps(state, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    else:
+        data = json.dumps(state, ensure_ascii=False, indent=2).encode("utf-8")
+    tmp = STATE_PATH + ".tmp"
+    with open(tmp, "wb", buffering=64 * 1024) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, STATE_PATH)
+
+    # rename 자체도 디스크에 남도록 디렉터리 fsync (O_DIRECTORY 없는 OS는 생략)
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(os.path.dirname(os.path.abspath(STATE_PATH)), os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
 
 
 # ---------------------------
 # Telegram
 # ---------------------------
-def tg_get_updates(offset: int):
-    r = requests.get(
+def tg_get_updates(offset: int, long_poll: bool = True):
+    # 발송 창 밖에서는 short poll(timeout=0)로 대기 없이 바로 반환
+    poll_timeout = 20 if long_poll else 0
+    r = SESSION.get(
         f"{TG_BASE}/getUpdates",
-        params={"timeout": 20, "offset": offset},
-        timeout=30,
+        params={"timeout": poll_timeout, "offset": offset},
+        timeout=poll_timeout + 10,
     )
     r.raise_for_status()
     return r.json().get("result", [])
 
 
 def tg_send(chat_id: int, text: str):
-    r = requests.post(
+    r = SESSION.post(
         f"{TG_BASE}/sendMessage",
         data={"chat_id": chat_id, "text": text},
         timeout=20,
@@ -60,8 +107,28 @@ def tg_send(chat_id: int, text: str):
     r.raise_for_status()
 
 
+def tg_send_batched(chat_id: int, parts: list[str]):
+    """
+    여러 답장을 한 메시지로 합쳐 발송 (Telegram 4096자 제한 넘으면 나눠서)
+    """
+    buf = ""
+    for part in parts:
+        while len(part) > TG_MAX_MESSAGE_LEN:
+            if buf:
+                tg_send(chat_id, buf)
+                buf = ""
+            tg_send(chat_id, part[:TG_MAX_MESSAGE_LEN])
+            part = part[TG_MAX_MESSAGE_LEN:]
+        if buf and len(buf) + 1 + len(part) > TG_MAX_MESSAGE_LEN:
+            tg_send(chat_id, buf)
+            buf = ""
+        buf = f"{buf}\n{part}" if buf else part
+    if buf:
+        tg_send(chat_id, buf)
+
+
 def normalize_ticker(s: str) -> str:
-    return re.sub(r"[^A-Za-z0-9\.\-\_]", "", s.strip()).upper()
+    return TICKER_CLEAN_RE.sub("", s.strip()).upper()
 
 
 def parse_cmd(text: str):
@@ -88,171 +155,254 @@ def parse_cmd(text: str):
     # add/del용 ticker list (콤마/공백 혼합 지원)
     tickers = []
     if args:
-        raw = re.split(r"[,\s]+", args)
-        tickers = [normalize_ticker(x) for x in raw if normalize_ticker(x)]
+        raw = TICKER_SPLIT_RE.split(args)
+        tickers = [n for x in raw if (n := normalize_ticker(x))]
 
     return cmd, args, tickers
 
 
+# ---------------------------
+# Commands
+# 각 핸들러: (state, replies, args, tickers) -> state 변경 여부
+# 답장은 replies에 쌓고 handle_updates 끝에서 채팅별로 한 번에 발송
+# ---------------------------
+def cmd_start(state: dict, replies: list[str], args: str, tickers: list[str]) -> bool:
+    replies.append("OK. /list, /add TICKER, /del TICKER 를 사용할 수 있어요.")
+    return False
 
-def handle_updates(state: dict) -> bool:
-    """
-    텔레그램 업데이트를 폴링하여 state 반영.
-    - allowed_user_id 외는 무시
-    - chat_id 자동 저장
-    - /add /del /list 처리
-    - last_update_id 갱신
-    반환: state가 변경되었는지
-    """
-    changed = False
-    offset = int(state.get("last_update_id", 0)) + 1
 
-    updates = tg_get_updates(offset=offset)
-    if not updates:
+def cmd_list(state: dict, replies: list[str], args: str, tickers: list[str]) -> bool:
+    cur = state.get("tickers", [])
+    replies.append("Tickers: " + (", ".join(cur) if cur else "(empty)"))
+    return False
+
+
+def cmd_add(state: dict, replies: list[str], args: str, tickers: list[str]) -> bool:
+    if not tickers:
+        replies.append("Usage: /add TICKER (예: /add MU)")
         return False
 
-    for u in updates:
-        state["last_update_id"] = max(state.get("last_update_id", 0), u.get("update_id", 0))
-        changed = True
+    # state["tickers"]는 정렬 상태 유지 -> 전체 재정렬 없이 제자리 삽입
+    cur = state.setdefault("tickers", [])
+    added = []
+    for t in tickers:
+        if t not in cur:
+            bisect.insort(cur, t)
+            added.append(t)
+    if not added:
+        # 이미 있는 종목만 들어온 경우 전체 목록 재전송 생략
+        replies.append("No change.")
+        return False
+    replies.append("Updated: " + ", ".join(cur))
+    return True
 
-        msg = u.get("message") or u.get("edited_message")
-        if not msg:
-            continue
 
-        from_user = msg.get("from", {})
-        user_id = from_user.get("id")
-        chat_id = (msg.get("chat") or {}).get("id")
-        text = msg.get("text", "")
+def cmd_del(state: dict, replies: list[str], args: str, tickers: list[str]) -> bool:
+    if not tickers:
+        replies.append("Usage: /del TICKER (예: /del MU)")
+        return False
 
-        # 보안: 허용 유저만
-        if user_id != ALLOWED_USER_ID:
-            continue
+    cur = state.setdefault("tickers", [])
+    removed = []
+    for t in tickers:
+        if t in cur:
+            cur.remove(t)
+            removed.append(t)
+    if not removed:
+        replies.append("No change.")
+        return False
+    replies.append("Updated: " + (", ".join(cur) if cur else "(empty)"))
+    return True
 
-        # optional: 특정 채팅방만 허용
-        if FORCE_CHAT_ID and chat_id != FORCE_CHAT_ID:
-            continue
 
-        # chat_id 저장(처음 1회)
-        if state.get("chat_id") != chat_id:
-            state["chat_id"] = chat_id
-            changed = True
+def cmd_names(state: dict, replies: list[str], args: str, tickers: list[str]) -> bool:
+    names = state.get("names", {})
+    if not names:
+        replies.append("Names: (empty)")
+    else:
+        # 보기 좋게 정렬 출력
+        items = [f"{k}={v}" for k, v in sorted(names.items())]
+        replies.append("Names: " + ", ".join(items))
+    return False
 
-        cmd, args, tickers = parse_cmd(text)
 
-        if cmd in ("/start",):
-            tg_send(chat_id, "OK. /list, /add TICKER, /del TICKER 를 사용할 수 있어요.")
-            continue
+def cmd_name(state: dict, replies: list[str], args: str, tickers: list[str]) -> bool:
+    # 형식: /name MU 마이크론
+    # args에서 첫 토큰이 ticker, 나머지 전체가 name
+    if not args:
+        replies.append("Usage: /name TICKER 한국명 (예: /name MU 마이크론)")
+        return False
 
-        if cmd == "/list":
-            cur = state.get("tickers", [])
-            tg_send(chat_id, "Tickers: " + (", ".join(cur) if cur else "(empty)"))
-            continue
+    parts2 = args.split(maxsplit=1)
+    if len(parts2) < 2:
+        replies.append("Usage: /name TICKER 한국명 (예: /name MU 마이크론)")
+        return False
 
-        if cmd == "/add":
-            cur = set(state.get("tickers", []))
-            for t in tickers:
-                cur.add(t)
-            new_list = sorted(cur)
-            if new_list != state.get("tickers", []):
-                state["tickers"] = new_list
-                changed = True
-            tg_send(chat_id, "Updated: " + ", ".join(state["tickers"]))
-            continue
+    t = normalize_ticker(parts2[0])
+    name = parts2[1].strip()
 
-        if cmd == "/del":
-            cur = set(state.get("tickers", []))
-            for t in tickers:
-                cur.discard(t)
-            new_list = sorted(cur)
-            if new_list != state.get("tickers", []):
-                state["tickers"] = new_list
-                changed = True
-            tg_send(chat_id, "Updated: " + (", ".join(state["tickers"]) if state["tickers"] else "(empty)"))
-            continue
+    if not t or not name:
+        replies.append("Usage: /name TICKER 한국명 (예: /name MU 마이크론)")
+        return False
 
-        if cmd == "/names":
-            names = state.get("names", {})
-            if not names:
-                tg_send(chat_id, "Names: (empty)")
-            else:
-                # 보기 좋게 정렬 출력
-                items = [f"{k}={v}" for k, v in sorted(names.items())]
-                tg_send(chat_id, "Names: " + ", ".join(items))
-            continue
+    dirty = False
+    names = state.get("names")
+    if not isinstance(names, dict):
+        names = {}
+        state["names"] = names
+        dirty = True
 
-        if cmd == "/name":
-            # 형식: /name MU 마이크론
-            # args에서 첫 토큰이 ticker, 나머지 전체가 name
-            if not args:
-                tg_send(chat_id, "Usage: /name TICKER 한국명 (예: /name MU 마이크론)")
-                continue
-
-            parts2 = args.split(maxsplit=1)
-            if len(parts2) < 2:
-                tg_send(chat_id, "Usage: /name TICKER 한국명 (예: /name MU 마이크론)")
-                continue
-
-            t = normalize_ticker(parts2[0])
-            name = parts2[1].strip()
-
-            if not t or not name:
-                tg_send(chat_id, "Usage: /name TICKER 한국명 (예: /name MU 마이크론)")
-                continue
-
-            names = state.get("names")
-            if not isinstance(names, dict):
-                names = {}
-                state["names"] = names
-                changed = True
-
-            # 저장
-            prev = names.get(t)
-            if prev != name:
-                names[t] = name
-                changed = True
-
-            tg_send(chat_id, f"OK: {t} -> {name}")
-            continue
+    # 저장
+    if names.get(t) == name:
+        replies.append("No change.")
+        return dirty
+    names[t] = name
 
-        if cmd == "/unname":
-            # 형식: /unname MU (여러개도 허용: /unname MU NVDA)
-            if not tickers:
-                tg_send(chat_id, "Usage: /unname TICKER (예: /unname MU)")
-                continue
-
-            names = state.get("names")
-            if not isinstance(names, dict) or not names:
-                tg_send(chat_id, "Names: (empty)")
-                continue
-
-            removed = []
-            for t in tickers:
-                if t in names:
-                    del names[t]
-                    removed.append(t)
-                    changed = True
-
-            if removed:
-                tg_send(chat_id, "Removed: " + ", ".join(removed))
-            else:
-                tg_send(chat_id, "No matches.")
-            continue
-            
-        if cmd == "/test":
-            # 즉시 리포트 1회 발송 트리거
-            state["force_report"] = True
-            changed = True
-            tg_send(chat_id, "OK. 다음 실행에서 리포트를 즉시 생성해 보낼게요.")
+    replies.append(f"OK: {t} -> {name}")
+    return True
+
+
+def cmd_unname(state: dict, replies: list[str], args: str, tickers: list[str]) -> bool:
+    # 형식: /unname MU (여러개도 허용: /unname MU NVDA)
+    if not tickers:
+        replies.append("Usage: /unname TICKER (예: /unname MU)")
+        return False
+
+    names = state.get("names")
+    if not isinstance(names, dict) or not names:
+        replies.append("Names: (empty)")
+        return False
+
+    removed = []
+    for t in tickers:
+        if t in names:
+            del names[t]
+            removed.append(t)
+
+    if removed:
+        replies.append("Removed: " + ", ".join(removed))
+    else:
+        replies.append("No matches.")
+    return bool(removed)
+
+
+def cmd_test(state: dict, replies: list[str], args: str, tickers: list[str]) -> bool:
+    # 즉시 리포트 1회 발송 트리거
+    dirty = False
+    if not state.get("force_report"):
+        state["force_report"] = True
+        dirty = True
+    replies.append("OK. 다음 실행에서 리포트를 즉시 생성해 보낼게요.")
+    return dirty
+
+
+def cmd_reset(state: dict, replies: list[str], args: str, tickers: list[str]) -> bool:
+    dirty = False
+    if state.get("last_sent_kst_date") is not None or state.get("force_report"):
+        state["last_sent_kst_date"] = None
+        state["force_report"] = False
+        dirty = True
+    replies.append("OK. last_sent_kst_date를 초기화했어요. /test로 다시 발송 테스트할 수 있어요.")
+    return dirty
+
+
+COMMAND_HANDLERS = {
+    "/start": cmd_start,
+    "/list": cmd_list,
+    "/add": cmd_add,
+    "/del": cmd_del,
+    "/names": cmd_names,
+    "/name": cmd_name,
+    "/unname": cmd_unname,
+    "/test": cmd_test,
+    "/reset": cmd_reset,
+}
+
+
+def handle_update(state: dict, u: dict, outbox: dict) -> bool:
+    """
+    update 1건 처리. 답장은 outbox[chat_id]에 쌓음
+    반환: state가 실제로 변경되었는지
+    """
+    state_dirty = False
+
+    msg = u.get("message") or u.get("edited_message")
+    if not msg:
+        return False
+
+    from_user = msg.get("from", {})
+    user_id = from_user.get("id")
+    chat_id = (msg.get("chat") or {}).get("id")
+    text = msg.get("text", "")
+
+    # 보안: 허용 유저만
+    if user_id != ALLOWED_USER_ID:
+        return False
+
+    # optional: 특정 채팅방만 허용
+    if FORCE_CHAT_ID and chat_id != FORCE_CHAT_ID:
+        return False
+
+    # chat_id 저장(처음 1회)
+    if state.get("chat_id") != chat_id:
+        state["chat_id"] = chat_id
+        state_dirty = True
+
+    cmd, args, tickers = parse_cmd(text)
+
+    handler = COMMAND_HANDLERS.get(cmd)
+    if handler and handler(state, outbox[chat_id], args, tickers):
+        state_dirty = True
+
+    return state_dirty
+
+
+def handle_updates(state: dict, long_poll: bool = True) -> bool:
+    """
+    텔레그램 업데이트를 폴링하여 state 반영.
+    - allowed_user_id 외는 무시
+    - chat_id 자동 저장
+    - COMMAND_HANDLERS의 명령 처리
+    - last_update_id 갱신
+    - long_poll=False면 getUpdates를 대기 없이 조회
+    반환: state가 실제로 변경되었는지 (/list 등 조회만 한 경우 False)
+    """
+    state_dirty = False
+    last_update_id = int(state.get("last_update_id", 0))
+    offset = last_update_id + 1
+
+    updates = tg_get_updates(offset=offset, long_poll=long_poll)
+    if not updates:
+        return False
+
+    outbox = defaultdict(list)  # chat_id -> 답장 목록
+    max_id = last_update_id
+    for u in updates:
+        max_id = max(max_id, u.get("update_id", 0))
+        # 한 건 실패해도 나머지 처리/last_update_id 저장/답장 발송은 계속
+        try:
+            if handle_update(state, u, outbox):
+                state_dirty = True
+        except Exception as e:
+            print(f"[WARN] Update {u.get('update_id')} handling error: {e}")
+            # 핸들러가 중간까지 state를 바꿨을 수 있으므로 저장 대상으로
+            state_dirty = True
+
+    # last_update_id는 루프 끝에서 한 번만 반영
+    if max_id > last_update_id:
+        state["last_update_id"] = max_id
+        state_dirty = True
+
+    # 답장 발송 실패는 채팅별로 격리 (state 반영/다른 채팅 답장에 영향 없게)
+    for cid, parts in outbox.items():
+        if not parts:
             continue
+        try:
+            tg_send_batched(cid, parts)
+        except Exception as e:
+            print(f"[WARN] Telegram reply to {cid} failed: {e}")
 
-        if cmd == "/reset":
-            state["last_sent_kst_date"] = None
-            state["force_report"] = False
-            changed = True
-            tg_send(chat_id, "OK. last_sent_kst_date를 초기화했어요. /test로 다시 발송 테스트할 수 있어요.")
-            continue   
-    
-    return changed
+    return state_dirty
 
 
 # ---------------------------
@@ -262,10 +412,12 @@ def yahoo_quote(symbols: list[str]) -> dict[str, dict]:
     """
     폴백용: Yahoo quote endpoint.
     여러 종목 한 번에 조회.
+    v7은 crumb 없으면 401이 잦음 -> 짧은 timeout, 200 아니면 바로 {}
     """
     url = "https://query1.finance.yahoo.com/v7/finance/quote"
-    r = requests.get(url, params={"symbols": ",".join(symbols)}, timeout=20)
-    r.raise_for_status()
+    r = SESSION.get(url, params={"symbols": ",".join(symbols)}, timeout=5)
+    if r.status_code != 200:
+        return {}
     rows = r.json().get("quoteResponse", {}).get("result", [])
     out = {}
     for row in rows:
@@ -275,29 +427,61 @@ def yahoo_quote(symbols: list[str]) -> dict[str, dict]:
     return out
 
 
-def get_close_and_prev_close_yfinance(symbol: str):
+def apply_quote_fallback(sym: str, close, prev_close, ext_px, q: dict):
+    """
+    fetch_one에서 비어 있는 값만 quote 행으로 채움
+    """
+    if close is None or prev_close is None:
+        # 폴백: regularMarketPreviousClose(전일종가), regularMarketPrice(현재/마감 근접)
+        pc = q.get("regularMarketPreviousClose")
+        rp = q.get("regularMarketPrice")
+        if pc is not None and rp is not None:
+            prev_close = float(pc)
+            close = float(rp)
+
+    if ext_px is None:
+        # after-hours가 없을 때는 프리마켓/정규로 대체하지 않는 게 깔끔함
+        v = q.get("postMarketPrice")
+        if v is not None:
+            ext_px = float(v)
+
+    return sym, close, prev_close, ext_px
+
+
+def get_ticker(symbol: str, ticker_cache: dict | None = None):
+    """
+    yf.Ticker 재사용 (build_report 동안 종목당 1개)
+    """
+    if ticker_cache is None:
+        return yf.Ticker(symbol)
+    t = ticker_cache.get(symbol)
+    if t is None:
+        t = ticker_cache[symbol] = yf.Ticker(symbol)
+    return t
+
+
+def get_close_and_prev_close_yfinance(symbol: str, ticker_cache: dict | None = None):
     """
     당일 종가 + 전일 종가 (변화율 계산용)
     """
-    t = yf.Ticker(symbol)
-    df = t.history(period="15d", interval="1d", auto_adjust=False)
+    t = get_ticker(symbol, ticker_cache)
+    df = t.history(period=DAILY_PERIOD, interval="1d", auto_adjust=False)
     if df is None or df.empty or len(df) < 2:
         raise RuntimeError("not enough daily data")
 
-    close = float(df["Close"].iloc[-1])
-    prev_close = float(df["Close"].iloc[-2])
+    # 필요한 건 마지막 두 종가뿐 -> Close 컬럼 끝 2개만 꺼냄
+    prev_close, close = (float(v) for v in df["Close"].tail(2).to_numpy())
     day = df.index[-1].date().isoformat()
     return day, close, prev_close
 
 
-
-def get_extended_last_yfinance(symbol: str):
+def get_extended_last_yfinance(symbol: str, ticker_cache: dict | None = None):
     """
-    extended last: 1분봉 + prepost=True 마지막 bar close
+    extended last: 5분봉 + prepost=True 마지막 bar close
     (yfinance history의 prepost 파라미터로 extended 세션 포함) :contentReference[oaicite:3]{index=3}
     """
-    t = yf.Ticker(symbol)
-    df = t.history(period="1d", interval="1m", prepost=True, auto_adjust=False)
+    t = get_ticker(symbol, ticker_cache)
+    df = t.history(period="1d", interval=INTRADAY_INTERVAL, prepost=True, auto_adjust=False)
     if df is None or df.empty:
         raise RuntimeError("empty intraday")
     ts = df.index[-1]
@@ -310,8 +494,85 @@ def get_extended_last_yfinance(symbol: str):
     return ts_et, px
 
 
+def download_batch(tickers: list[str], **kwargs):
+    """
+    전 종목을 yf.download 한 번으로 조회 (내부 스레드풀로 병렬 요청).
+    실패 시 None -> 심볼별 history()로 폴백
+    """
+    try:
+        df = yf.download(
+            tickers,
+            auto_adjust=False,
+            group_by="ticker",
+            threads=True,
+            progress=False,
+            **kwargs,
+        )
+    except Exception:
+        return None
+    if df is None or df.empty:
+        return None
+    return df
+
+
+def batch_closes(df, symbol: str):
+    """
+    download_batch 결과에서 symbol의 Close 시리즈(NaN 제외).
+    없으면 KeyError
+    """
+    if df is None:
+        raise KeyError(symbol)
+    # 단일 종목이면 yfinance 버전에 따라 컬럼이 MultiIndex가 아닐 수 있음
+    sub = df[symbol] if getattr(df.columns, "nlevels", 1) > 1 else df
+    closes = sub["Close"].dropna()
+    if closes.empty:
+        raise KeyError(symbol)
+    return closes
+
+
+def batch_prices(sym: str, daily, intraday):
+    """
+    download_batch 결과에서 (sym, close, prev_close, ext_px). I/O 없음, 없는 값은 None
+    """
+    close = prev_close = ext_px = None
+    try:
+        closes = batch_closes(daily, sym).tail(2).to_numpy()
+        if len(closes) >= 2:
+            prev_close, close = float(closes[0]), float(closes[1])
+    except KeyError:
+        pass
+
+    try:
+        ext_px = float(batch_closes(intraday, sym).iloc[-1])
+    except KeyError:
+        pass
+
+    return sym, close, prev_close, ext_px
+
+
+def fetch_one(sym: str, close, prev_close, ext_px, ticker_cache: dict):
+    """
+    배치에서 못 구한 값만 심볼별 yfinance history()로 채움 (못 구한 값은 None)
+    """
+    # 1) 종가/전일종가
+    if close is None or prev_close is None:
+        try:
+            _, close, prev_close = get_close_and_prev_close_yfinance(sym, ticker_cache)
+        except Exception:
+            close = prev_close = None
+
+    # 2) 애프터마켓 가격 가져오기
+    if ext_px is None:
+        try:
+            _, ext_px = get_extended_last_yfinance(sym, ticker_cache)  # (ts_et, px)
+        except Exception:
+            ext_px = None
+
+    return sym, close, prev_close, ext_px
+
+
 def build_report(state: dict) -> str:
-    tickers = [normalize_ticker(t) for t in state.get("tickers", []) if normalize_ticker(t)]
+    tickers = [n for t in state.get("tickers", []) if (n := normalize_ticker(t))]
     if not tickers:
         return "No tickers."
 
@@ -319,46 +580,40 @@ def build_report(state: dict) -> str:
     if not isinstance(names_map, dict):
         names_map = {}
 
-    # 폴백 데이터(한 번에)
-    quote_map = {}
-    try:
-        quote_map = yahoo_quote(tickers)
-    except Exception:
-        quote_map = {}
+    # 일봉/5분봉(extended)을 종목 전체 한 번씩만 요청
+    daily = download_batch(tickers, period=DAILY_PERIOD, interval="1d")
+    intraday = download_batch(tickers, period="1d", interval=INTRADAY_INTERVAL, prepost=True)
+    results = [batch_prices(sym, daily, intraday) for sym in tickers]
+
+    # 배치에 없는 종목만 history() 폴백 -> I/O 대기라 스레드로 병렬 처리 (입력 순서 유지)
+    pending = [i for i, r in enumerate(results) if None in r[1:]]
+    if pending:
+        ticker_cache = {}
+        with ThreadPoolExecutor(max_workers=min(MAX_FETCH_WORKERS, len(pending))) as ex:
+            filled = ex.map(lambda i: fetch_one(*results[i], ticker_cache), pending)
+            for i, r in zip(pending, filled):
+                results[i] = r
+
+    # 그래도 비어 있는 종목만 quote로 보충 (스레드 밖에서 1회)
+    missing = [r[0] for r in results if r[1] is None or r[2] is None or r[3] is None]
+    if missing:
+        # 폴백 데이터(못 구한 종목만 한 번에)
+        try:
+            quote_map = yahoo_quote(missing)
+        except Exception:
+            quote_map = {}
+        results = [
+            apply_quote_fallback(*r, quote_map.get(r[0], {})) if r[0] in missing else r
+            for r in results
+        ]
 
     now_kst = datetime.now(KST)
     wk_kr = ["월", "화", "수", "목", "금", "토", "일"][now_kst.weekday()]
     header = f"[{now_kst.month}월{now_kst.day}일 {wk_kr}요일 미국 주식 마감]"
     lines = [header]
 
-    for sym in tickers:
+    for sym, close, prev_close, ext_px in results:
         name = names_map.get(sym, sym)
-        # 이하 로직은 기존 “마감/애프터 변화율” 계산 그대로 두되,
-        # 출력에서 name만 사용하면 됩니다.
-        close = prev_close = None
-        try:
-            _, close, prev_close = get_close_and_prev_close_yfinance(sym)
-        except Exception:
-            q = quote_map.get(sym, {})
-            # 폴백: regularMarketPreviousClose(전일종가), regularMarketPrice(현재/마감 근접)
-            pc = q.get("regularMarketPreviousClose")
-            rp = q.get("regularMarketPrice")
-            if pc is not None and rp is not None:
-                prev_close = float(pc)
-                close = float(rp)
-
-        # 2) 애프터마켓 가격 가져오기 (yfinance 우선, 실패 시 quote)
-        ext_px = None
-        try:
-            _, ext_px = get_extended_last_yfinance(sym)  # (ts_et, px)
-        except Exception:
-            q = quote_map.get(sym, {})
-            v = q.get("postMarketPrice")
-            if v is None:
-                # after-hours가 없을 때는 프리마켓/정규로 대체하지 않는 게 깔끔함
-                ext_px = None
-            else:
-                ext_px = float(v)
 
         # 3) 출력 구성
         if close is None or prev_close is None or prev_close == 0:
@@ -381,7 +636,6 @@ def build_report(state: dict) -> str:
     return "\n".join(lines)
 
 
-
 # ---------------------------
 # Trigger window & main
 # ---------------------------
@@ -399,28 +653,26 @@ def main():
     state = load_state()
     state_changed = False
 
+    now_kst = datetime.now(KST)
+    today_kst = now_kst.date().isoformat()
+
     # 1) 텔레그램 업데이트 처리(/add,/del,/list)
+    #    long poll(20초 대기)은 발송 창 안에서만
     try:
-        if handle_updates(state):
+        if handle_updates(state, long_poll=in_send_window_kst(now_kst)):
             state_changed = True
     except Exception as e:
         # 업데이트 처리 실패해도 리포트 로직은 계속 진행
         print(f"[WARN] Telegram update handling error: {e}")
 
-    now_kst = datetime.now(KST)
-    today_kst = now_kst.date().isoformat()
-
     # 2) 06:30~06:45 사이 && 오늘 미발송이면 발송
-    
     force_report = bool(state.get("force_report", False))
     if (force_report or in_send_window_kst(now_kst)) and state.get("last_sent_kst_date") != today_kst:
-
-        
         chat_id = state.get("chat_id")
         if chat_id is None:
             print("[INFO] chat_id is null. Send /start to the bot once.")
         else:
-            msg = build_report(state)            
+            msg = build_report(state)
             try:
                 tg_send(chat_id, msg)
                 # 3) 발송 후 last_sent_kst_date 저장